@@ -13,53 +13,81 @@ Usage:
   ./play_on_hdmi.py movie.mp4 --backend kmsdrm   # force kmsdrm
   ./play_on_hdmi.py movie.mp4 --connector-id 29  # attempt to enable connector 29 (if modetest available) before playing
   ./play_on_hdmi.py movie.mp4 --detach           # start ffplay detached (so SSH can disconnect)
+  ./play_on_hdmi.py movie.mp4 --probe-timeout 1  # count a backend as working once ffplay survives 1s
 
 Notes:
  - Requires ffplay (part of ffmpeg) installed and SDL compiled with the desired backends.
+ - Connector ids are read via libdrm (ctypes) when /dev/dri/card* is accessible, else parsed from `modetest -c`.
  - To enable connectors or force modes from userspace you may need libdrm-tests (modetest) and root.
 """
 
+import math
 import os
 import sys
-import argparse
-import shutil
 import subprocess
 import time
-import re
+from functools import lru_cache
 
 
+@lru_cache(maxsize=None)
 def find_ffplay():
+    # shutil (and the re/fnmatch it pulls in) is only needed for the PATH lookup
+    import shutil
+
     return shutil.which("ffplay")
 
 
+@lru_cache(maxsize=None)
+def _modetest_path():
+    import shutil
+
+    return shutil.which("modetest")
+
+
+def _read_small(path, size=4096):
+    # sysfs attributes are tiny; skip the buffered/text io layers of open()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, size).decode("ascii", "replace")
+    finally:
+        os.close(fd)
+
+
+def _parse_sys_connector(entry):
+    info = {
+        "name": entry.name,
+        "path": entry.path,
+        "status": "unknown",
+        "first_mode": None,
+    }
+    try:
+        info["status"] = _read_small(entry.path + "/status").strip()
+    except Exception:
+        pass
+    if info["status"] == "disconnected":
+        # disconnected outputs have no useful modes; skip the read (connectors
+        # without hot-plug detect report "unknown" but still list modes)
+        return info
+    try:
+        # only the first mode is reported, which sits in the first read
+        modes = _read_small(entry.path + "/modes").split()
+        info["first_mode"] = modes[0] if modes else None
+    except Exception:
+        pass
+    return info
+
+
 def list_sys_drm_connectors():
     sysdrm = "/sys/class/drm"
-    connectors = []
     if not os.path.isdir(sysdrm):
-        return connectors
-    for entry in sorted(os.listdir(sysdrm)):
+        return []
+    with os.scandir(sysdrm) as it:
         # typical entries: card0, card0-HDMI-A-1, card0-HDMI-A-2, renderD128, version
-        if entry.startswith("card") and "-" in entry:
-            path = os.path.join(sysdrm, entry)
-            info = {
-                "name": entry,
-                "path": path,
-                "status": "unknown",
-                "first_mode": None,
-            }
-            try:
-                with open(os.path.join(path, "status"), "r") as f:
-                    info["status"] = f.read().strip()
-            except Exception:
-                pass
-            try:
-                with open(os.path.join(path, "modes"), "r") as f:
-                    modes = [ln.strip() for ln in f.readlines() if ln.strip()]
-                    info["first_mode"] = modes[0] if modes else None
-            except Exception:
-                pass
-            connectors.append(info)
-    return connectors
+        entries = sorted(
+            (e for e in it if e.name.startswith("card") and "-" in e.name),
+            key=lambda e: e.name,
+        )
+    return [_parse_sys_connector(e) for e in entries]
 
 
 def print_sys_connectors(conn):
@@ -71,77 +99,276 @@ def print_sys_connectors(conn):
         print(f"  {c['name']:20} status={c['status']:9} mode={c['first_mode']}")
 
 
-def modetest_list_connectors():
-    modetest = shutil.which("modetest")
-    if not modetest:
+# only the first few modes of a connector are ever used (first one is set, listing shows 3)
+MAX_MODES = 3
+
+# DRM_MODE_CONNECTOR_* names as the kernel spells them (drm_connector_enum_list,
+# also used in sysfs entries like card0-HDMI-A-1); modetest's own spellings differ
+_DRM_CONNECTOR_TYPES = [
+    "Unknown", "VGA", "DVI-I", "DVI-D", "DVI-A", "Composite", "SVIDEO", "LVDS",
+    "Component", "DIN", "DP", "HDMI-A", "HDMI-B", "TV", "eDP", "Virtual", "DSI",
+    "DPI", "Writeback", "SPI", "USB",
+]
+# drmModeConnection values
+_DRM_CONNECTION = {1: "connected", 2: "disconnected", 3: "unknown"}
+
+
+@lru_cache(maxsize=None)
+def _libdrm():
+    # ctypes and the libdrm struct layouts are only set up on first use, so
+    # importing this file (or playing without listing connectors) doesn't pay for them
+    import ctypes
+
+    class DrmModeRes(ctypes.Structure):
+        _fields_ = [
+            ("count_fbs", ctypes.c_int),
+            ("fbs", ctypes.POINTER(ctypes.c_uint32)),
+            ("count_crtcs", ctypes.c_int),
+            ("crtcs", ctypes.POINTER(ctypes.c_uint32)),
+            ("count_connectors", ctypes.c_int),
+            ("connectors", ctypes.POINTER(ctypes.c_uint32)),
+            ("count_encoders", ctypes.c_int),
+            ("encoders", ctypes.POINTER(ctypes.c_uint32)),
+            ("min_width", ctypes.c_uint32),
+            ("max_width", ctypes.c_uint32),
+            ("min_height", ctypes.c_uint32),
+            ("max_height", ctypes.c_uint32),
+        ]
+
+    class DrmModeModeInfo(ctypes.Structure):
+        _fields_ = [
+            ("clock", ctypes.c_uint32),
+            ("hdisplay", ctypes.c_uint16),
+            ("hsync_start", ctypes.c_uint16),
+            ("hsync_end", ctypes.c_uint16),
+            ("htotal", ctypes.c_uint16),
+            ("hskew", ctypes.c_uint16),
+            ("vdisplay", ctypes.c_uint16),
+            ("vsync_start", ctypes.c_uint16),
+            ("vsync_end", ctypes.c_uint16),
+            ("vtotal", ctypes.c_uint16),
+            ("vscan", ctypes.c_uint16),
+            ("vrefresh", ctypes.c_uint32),
+            ("flags", ctypes.c_uint32),
+            ("type", ctypes.c_uint32),
+            ("name", ctypes.c_char * 32),
+        ]
+
+    class DrmModeConnector(ctypes.Structure):
+        _fields_ = [
+            ("connector_id", ctypes.c_uint32),
+            ("encoder_id", ctypes.c_uint32),
+            ("connector_type", ctypes.c_uint32),
+            ("connector_type_id", ctypes.c_uint32),
+            ("connection", ctypes.c_int),
+            ("mmWidth", ctypes.c_uint32),
+            ("mmHeight", ctypes.c_uint32),
+            ("subpixel", ctypes.c_int),
+            ("count_modes", ctypes.c_int),
+            ("modes", ctypes.POINTER(DrmModeModeInfo)),
+            ("count_props", ctypes.c_int),
+            ("props", ctypes.POINTER(ctypes.c_uint32)),
+            ("prop_values", ctypes.POINTER(ctypes.c_uint64)),
+            ("count_encoders", ctypes.c_int),
+            ("encoders", ctypes.POINTER(ctypes.c_uint32)),
+        ]
+
+    class DrmVersion(ctypes.Structure):
+        _fields_ = [
+            ("version_major", ctypes.c_int),
+            ("version_minor", ctypes.c_int),
+            ("version_patchlevel", ctypes.c_int),
+            ("name_len", ctypes.c_int),
+            ("name", ctypes.c_char_p),
+            ("date_len", ctypes.c_int),
+            ("date", ctypes.c_char_p),
+            ("desc_len", ctypes.c_int),
+            ("desc", ctypes.c_char_p),
+        ]
+
+    try:
+        lib = ctypes.CDLL("libdrm.so.2")
+    except OSError:
         return None
+    lib.drmModeGetResources.restype = ctypes.POINTER(DrmModeRes)
+    lib.drmModeGetResources.argtypes = [ctypes.c_int]
+    lib.drmModeFreeResources.argtypes = [ctypes.POINTER(DrmModeRes)]
+    lib.drmModeGetConnector.restype = ctypes.POINTER(DrmModeConnector)
+    lib.drmModeGetConnector.argtypes = [ctypes.c_int, ctypes.c_uint32]
+    lib.drmModeFreeConnector.argtypes = [ctypes.POINTER(DrmModeConnector)]
+    lib.drmGetVersion.restype = ctypes.POINTER(DrmVersion)
+    lib.drmGetVersion.argtypes = [ctypes.c_int]
+    lib.drmFreeVersion.argtypes = [ctypes.POINTER(DrmVersion)]
+    return lib
+
+
+def _dri_cards():
     try:
-        p = subprocess.run(
-            [modetest, "-c"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True,
-        )
-        out = p.stdout.splitlines()
-    except subprocess.CalledProcessError:
+        names = os.listdir("/dev/dri")
+    except OSError:
+        return []
+    cards = [n for n in names if n.startswith("card") and n[4:].isdigit()]
+    cards.sort(key=lambda n: int(n[4:]))
+    return ["/dev/dri/" + n for n in cards]
+
+
+def _drm_get_connectors():
+    # (card, connectors) with connectors shaped like the modetest parser below,
+    # straight from the DRM ioctls; None if libdrm or a modesetting-capable
+    # /dev/dri/card* isn't available.
+    # connector ids only mean something on their card, so each dict records the
+    # card's driver name (what modetest -M takes) for modetest_set_mode
+    lib = _libdrm()
+    if lib is None:
+        return None
+    for card in _dri_cards():
+        try:
+            fd = os.open(card, os.O_RDWR | os.O_CLOEXEC)
+        except OSError:
+            continue
+        try:
+            res = lib.drmModeGetResources(fd)
+            if not res:
+                # render-only node (e.g. v3d on a Pi 5); try the next card
+                continue
+            try:
+                ids = res.contents.connectors[: res.contents.count_connectors]
+            finally:
+                lib.drmModeFreeResources(res)
+            driver = None
+            ver = lib.drmGetVersion(fd)
+            if ver:
+                try:
+                    driver = ver.contents.name.decode("ascii", "replace")
+                finally:
+                    lib.drmFreeVersion(ver)
+            connectors = []
+            for cid in ids:
+                conn = lib.drmModeGetConnector(fd, cid)
+                if not conn:
+                    continue
+                try:
+                    c = conn.contents
+                    if c.connector_type < len(_DRM_CONNECTOR_TYPES):
+                        tname = _DRM_CONNECTOR_TYPES[c.connector_type]
+                    else:
+                        tname = _DRM_CONNECTOR_TYPES[0]
+                    modes = [
+                        c.modes[k].name.decode("ascii", "replace")
+                        for k in range(min(c.count_modes, MAX_MODES))
+                    ]
+                    connectors.append(
+                        {
+                            "id": c.connector_id,
+                            "type": f"{tname}-{c.connector_type_id}",
+                            "status": _DRM_CONNECTION.get(c.connection, "unknown"),
+                            "modes": modes,
+                            "driver": driver,
+                        }
+                    )
+                finally:
+                    lib.drmModeFreeConnector(conn)
+            return card, connectors
+        finally:
+            os.close(fd)
+    return None
+
+
+# modetest -c parser states
+_SEEK_HEADER, _SEEK_CONN, _SEEK_MODES, _IN_MODES = range(4)
+
+
+def _modetest_connector_header(line):
+    # expected form: "<id> <encoder> <status> <type> ..."
+    # (the column-name header line, blank lines and block contents don't match)
+    parts = line.split(None, 4)
+    if len(parts) >= 4 and parts[0].isdigit() and parts[1].isdigit():
+        return {
+            "id": int(parts[0]),
+            "type": parts[3],
+            "status": parts[2],
+            "modes": [],
+            # modetest's default device; modetest -s picks the same one
+            "driver": None,
+        }
+    return None
+
+
+def list_drm_connectors():
+    # (source, connectors): ask the kernel directly when possible, falling back to
+    # parsing modetest output; source is the card path or "modetest".
+    # (None, None) if neither works
+    found = _drm_get_connectors()
+    if found is not None:
+        return found
+    connectors = modetest_list_connectors()
+    if connectors is None:
+        return None, None
+    return "modetest", connectors
+
+
+def modetest_list_connectors():
+    modetest = _modetest_path()
+    if not modetest:
         return None
+    proc = subprocess.Popen(
+        [modetest, "-c"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
 
     connectors = []
-    i = 0
-    # find "Connectors:" header
-    while i < len(out) and "Connectors:" not in out[i]:
-        i += 1
-    if i >= len(out):
+    state = _SEEK_HEADER
+    with proc.stdout:
+        for line in proc.stdout:
+            if state == _SEEK_HEADER:
+                # find "Connectors:" header
+                if "Connectors:" in line:
+                    state = _SEEK_CONN
+            elif state in (_SEEK_CONN, _SEEK_MODES):
+                # modetest only prints "modes:" for connectors that have some, so a
+                # new connector header can arrive while still looking for it
+                conn = _modetest_connector_header(line)
+                if conn is not None:
+                    connectors.append(conn)
+                    modes = conn["modes"]
+                    state = _SEEK_MODES
+                elif state == _SEEK_MODES and "modes:" in line:
+                    state = _IN_MODES
+            else:
+                # collect subsequent indented mode lines up to the blank line
+                mode_line = line.strip()
+                if not mode_line:
+                    state = _SEEK_CONN
+                    continue
+                if len(modes) >= MAX_MODES:
+                    # consume the rest of the block without parsing
+                    continue
+                # mode_line often begins with resolution like "1920x1080" (or
+                # "1920x1080i" for interlaced; keep the full name, modetest -s matches on it)
+                tok = mode_line.split(None, 1)[0]
+                w, _, h = tok.partition("x")
+                if w.isdigit() and (h[:-1] if h.endswith("i") else h).isdigit():
+                    modes.append(tok)
+    if proc.wait() != 0 or state == _SEEK_HEADER:
         return None
-    i += 1  # skip "Connectors:" line
-    # skip header line (column names)
-    if i < len(out) and out[i].strip().startswith("id"):
-        i += 1
-
-    # parse connector blocks
-    while i < len(out):
-        line = out[i]
-        if not line.strip():
-            i += 1
-            continue
-        # expected form: "<id> <encoder> <status> <type> ..."
-        m = re.match(r"\s*(\d+)\s+(\d+)\s+(\w+)\s+(\S+)", line)
-        if m:
-            cid = int(m.group(1))
-            status = m.group(3)
-            ctype = m.group(4)
-            modes = []
-            i += 1
-            # look for the "modes:" block
-            while i < len(out) and "modes:" not in out[i]:
-                i += 1
-            if i < len(out) and "modes:" in out[i]:
-                i += 1
-                # collect subsequent indented mode lines
-                while i < len(out) and out[i].strip():
-                    mode_line = out[i].strip()
-                    # mode_line often begins with resolution like "1920x1080"
-                    mm = re.match(r"(\d+x\d+)", mode_line)
-                    if mm:
-                        modes.append(mm.group(1))
-                    i += 1
-            connectors.append(
-                {"id": cid, "type": ctype, "status": status, "modes": modes}
-            )
-        else:
-            i += 1
     return connectors
 
 
-def modetest_set_mode(connector_id, mode):
-    modetest = shutil.which("modetest")
+def modetest_set_mode(connector_id, mode, driver=None):
+    modetest = _modetest_path()
     if not modetest:
         raise RuntimeError(
             "modetest not installed (libdrm-tests). Install it to use --connector-id forcing."
         )
-    # Use sudo because modetest usually needs root to set modes
-    cmd = ["sudo", modetest, "-s", f"{connector_id}:{mode}"]
+    cmd = [modetest, "-s", f"{connector_id}:{mode}"]
+    if driver:
+        # the connector id was looked up on this driver's card; don't let modetest pick another
+        cmd[1:1] = ["-M", driver]
+    # Use sudo because modetest usually needs root to set modes (unless we already are root)
+    if os.geteuid() != 0:
+        cmd.insert(0, "sudo")
     print("running:", " ".join(cmd))
     subprocess.run(cmd, check=True)
 
@@ -150,41 +377,44 @@ def try_play_ffplay(video_path, backend_env=None, detach=False, timeout_probe=2)
     ffplay = find_ffplay()
     if not ffplay:
         raise RuntimeError("ffplay not found. Install ffmpeg (ffplay).")
-    env = os.environ.copy()
-    if backend_env:
-        env.update(backend_env)
+    # None lets the child inherit our environment without building a copy
+    env = {**os.environ, **backend_env} if backend_env else None
     cmd = [ffplay, "-fs", "-autoexit", "-hide_banner", "-loglevel", "error", video_path]
-    devnull = open(os.devnull, "wb")
-    preexec = None
-    if detach:
-        # detach subprocess so it survives SSH logout
-        preexec = os.setsid
     print(
         "launching ffplay with SDL_VIDEODRIVER="
-        + env.get("SDL_VIDEODRIVER", "<default>")
+        + (env or os.environ).get("SDL_VIDEODRIVER", "<default>")
     )
     proc = subprocess.Popen(
-        cmd, env=env, stdout=devnull, stderr=devnull, preexec_fn=preexec
+        cmd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        # this script holds no fds worth hiding from ffplay, and skipping the
+        # close loop (plus no preexec_fn) lets Python use the posix_spawn fast path
+        close_fds=False,
+        # detach subprocess (setsid) so it survives SSH logout
+        start_new_session=detach,
     )
     # probe quickly: if process exits immediately it's probably an error in the chosen backend
-    time.sleep(timeout_probe)
-    code = proc.poll()
-    if code is None:
-        # process is still running -> likely successful
-        if detach:
-            print(
-                f"ffplay started (pid {proc.pid}) detached; you can safely close the SSH session."
-            )
-            return 0
-        else:
-            # wait until finished
-            return proc.wait()
-    else:
+    try:
         # exited quickly
-        return code
+        return proc.wait(timeout=timeout_probe)
+    except subprocess.TimeoutExpired:
+        pass
+    # process is still running -> likely successful
+    if detach:
+        print(
+            f"ffplay started (pid {proc.pid}) detached; you can safely close the SSH session."
+        )
+        return 0
+    # wait until finished
+    return proc.wait()
 
 
 def main():
+    # imported here so using this file as a library doesn't pay for argparse
+    import argparse
+
     parser = argparse.ArgumentParser(
         description="Play MP4 on HDMI from console (ffplay)."
     )
@@ -215,21 +445,30 @@ def main():
         action="store_true",
         help="detach ffplay so it keeps running after SSH logout",
     )
+    parser.add_argument(
+        "--probe-timeout",
+        type=float,
+        default=2,
+        help="seconds ffplay must survive before a backend counts as working (default: 2)",
+    )
     args = parser.parse_args()
+    # nan would make proc.wait() never time out; inf likewise
+    if not (math.isfinite(args.probe_timeout) and args.probe_timeout > 0):
+        parser.error("--probe-timeout must be a finite number greater than 0")
 
     if args.list_connectors:
         syscon = list_sys_drm_connectors()
         print_sys_connectors(syscon)
-        mt = modetest_list_connectors()
+        source, mt = list_drm_connectors()
         if mt is None:
             print(
-                "\nmodetest not available or parsing failed; install libdrm-tests to get connector ids (optional)."
+                "\nno DRM device via libdrm and modetest not available or parsing failed; install libdrm-tests to get connector ids (optional)."
             )
         else:
-            print("\nmodetest connectors (ids):")
+            print(f"\nDRM connectors (ids, from {source}):")
             for c in mt:
                 print(
-                    f"  id={c['id']:3}  type={c['type']:8}  status={c['status']:10}  modes={c['modes'][:3]}"
+                    f"  id={c['id']:3}  type={c['type']:8}  status={c['status']:10}  modes={c['modes'][:MAX_MODES]}"
                 )
         return
 
@@ -241,12 +480,17 @@ def main():
         print("video not found:", args.video)
         sys.exit(2)
 
+    # no point trying backends (or setting modes) if ffplay isn't there at all
+    if not find_ffplay():
+        print("ffplay not found. Install ffmpeg (ffplay).")
+        sys.exit(3)
+
     # If user asked to set a connector id before play, try to get its mode then set it via modetest
     if args.connector_id is not None:
-        mt = modetest_list_connectors()
+        _, mt = list_drm_connectors()
         if mt is None:
             print(
-                "modetest not available or could not parse connectors. Install libdrm-tests and re-run."
+                "could not query DRM connectors (libdrm or modetest). Install libdrm-tests and re-run."
             )
             print(
                 "You can still try to play; the OS may already route output to the correct HDMI."
@@ -254,7 +498,7 @@ def main():
         else:
             found = [c for c in mt if c["id"] == args.connector_id]
             if not found:
-                print(f"connector id {args.connector_id} not listed by modetest.")
+                print(f"connector id {args.connector_id} not among the listed DRM connectors.")
             else:
                 c = found[0]
                 if c["status"] != "connected":
@@ -266,12 +510,16 @@ def main():
                         f"connector id {args.connector_id} has no reported modes; cannot set."
                     )
                 else:
-                    chosen_mode = c["modes"][0]  # pick the first available mode
-                    print(f"connector {args.connector_id} first mode: {chosen_mode}")
+                    # pick the first available mode, preferring progressive ones
+                    # (interlaced names end in "i", e.g. 1920x1080i)
+                    chosen_mode = next(
+                        (m for m in c["modes"] if not m.endswith("i")), c["modes"][0]
+                    )
+                    print(f"connector {args.connector_id} chosen mode: {chosen_mode}")
                     if args.force_mode:
-                        print("attempting to set mode via modetest (will use sudo)...")
+                        print("attempting to set mode via modetest (will use sudo if not root)...")
                         try:
-                            modetest_set_mode(args.connector_id, chosen_mode)
+                            modetest_set_mode(args.connector_id, chosen_mode, c["driver"])
                             print(
                                 "modetest mode set returned (should be visible on HDMI)."
                             )
@@ -305,7 +553,16 @@ def main():
             env = {}  # default SDL selection
 
         try:
-            rc = try_play_ffplay(args.video, backend_env=env, detach=args.detach)
+            rc = try_play_ffplay(
+                args.video,
+                backend_env=env,
+                detach=args.detach,
+                timeout_probe=args.probe_timeout,
+            )
+        except FileNotFoundError as e:
+            # ffplay itself could not be executed; other backends won't fare better
+            last_err = e
+            break
         except Exception as e:
             last_err = e
             rc = 1